@@ -1,84 +1,24 @@
 import streamlit as st
-import pandas as pd
-import google.generativeai as genai
-import json
-import os
-import re
 import io
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
-from thefuzz import process, fuzz
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from core import (
+    MENU_PROMPT, PRODUCTS_CSV, PROPOSAL_COLUMN_CONFIG, analyze_menu, apply_style, build_proposal_csv,
+    build_proposal_table, calc_totals, file_mtime, find_best_matches, get_api_key, get_product_master,
+    shrink_image,
+)
 
 # ----------------------------
 # 1. デザイン設定（ネイビー＆オレンジ）
 # ----------------------------
 st.set_page_config(page_title="食材比較提案システム", layout="wide")
 
-st.markdown("""
-<style>
-    html, body, [class*="css"] { font-family: 'Hiragino Kaku Gothic ProN', 'Meiryo', sans-serif; }
-    
-    /* ボタンデザイン */
-    .stButton>button { 
-        font-weight: bold; font-size: 20px; min-height: 65px; border-radius: 12px;
-        background-color: #FF851B; color: #001F3F; border: 2px solid #001F3F;
-    }
-    .stButton>button:hover { background-color: #e67616; color: #FFFFFF; }
-
-    /* 入力項目ラベル */
-    label { font-size: 18px !important; font-weight: bold !important; color: #FF851B !important; }
-
-    /* ヘッダー */
-    .main-header {
-        background: linear-gradient(135deg, #001F3F 0%, #003366 100%);
-        color: #FFFFFF; padding: 35px; border-radius: 15px; text-align: center;
-        margin-bottom: 30px; border-bottom: 5px solid #FF851B;
-    }
-</style>
-""", unsafe_allow_html=True)
+apply_style()
 
 # ----------------------------
-# 2. ロジック設定
-# ----------------------------
-
-def get_api_key():
-    """SecretsからAPIキーを取得"""
-    for key_name in ["GEMINI_API_KEY", "GOOGLE_API_KEY"]:
-        if key_name in st.secrets:
-            return st.secrets[key_name]
-    return None
-
-@st.cache_data
-def load_products():
-    """アクト商品データの読み込み"""
-    file_path = "products.csv"
-    try:
-        if not os.path.exists(file_path):
-            st.error(f"⚠️ ファイル '{file_path}' が見つかりません。")
-            return pd.DataFrame()
-        try:
-            df = pd.read_csv(file_path, encoding="utf-8-sig")
-        except:
-            df = pd.read_csv(file_path, encoding="shift-jis")
-        if "アクト単価" in df.columns:
-            df["アクト単価"] = pd.to_numeric(df["アクト単価"], errors='coerce').fillna(0)
-        return df
-    except Exception as e:
-        st.error(f"データ読み込みエラー: {e}")
-        return pd.DataFrame()
-
-def find_best_match(ingredient_name, master_df, threshold):
-    """商品名との曖昧マッチング"""
-    if master_df.empty or "商品名" not in master_df.columns:
-        return None, 0
-    choices = master_df["商品名"].astype(str).tolist()
-    best_match_name, score = process.extractOne(ingredient_name, choices, scorer=fuzz.partial_token_sort_ratio)
-    if score >= threshold:
-        match_row = master_df[master_df["商品名"] == best_match_name].iloc[0]
-        return match_row, score
-    return None, 0
-
-# ----------------------------
-# 3. メイン画面
+# 2. メイン画面
 # ----------------------------
 st.markdown("""
 <div class='main-header'>
@@ -115,11 +55,18 @@ st.divider()
 
 # 2. メニュー解析
 st.markdown("### 📸 2. メニュー写真の解析")
-uploaded_file = st.file_uploader("メニューを撮影した写真をアップロード", type=['png', 'jpg', 'jpeg'])
-
-if uploaded_file:
-    img = Image.open(uploaded_file)
-    st.image(img, caption="解析対象画像", width=400)
+uploaded_files = st.file_uploader("メニューを撮影した写真をアップロード（複数枚可）", type=['png', 'jpg', 'jpeg'], accept_multiple_files=True)
+
+if uploaded_files:
+    # 一度だけデコード・縮小し、同じJPEGバイト列を表示と解析の両方で使う
+    # （file_id ごとに保持し、ウィジェット操作による再実行ではデコードし直さない）
+    shrunk = st.session_state.get("shrunk_images", {})
+    images = [
+        shrunk[f.file_id] if f.file_id in shrunk else shrink_image(Image.open(io.BytesIO(f.getvalue())))
+        for f in uploaded_files
+    ]
+    st.session_state.shrunk_images = {f.file_id: image_bytes for f, image_bytes in zip(uploaded_files, images)}
+    st.image(images, caption=[f"解析対象画像：{f.name}" for f in uploaded_files], width=400)
 
     if st.button("🔍 解析を実行して比較表を作成", type="primary", use_container_width=True):
         if not api_key:
@@ -127,47 +74,37 @@ if uploaded_file:
         else:
             with st.spinner('AIが食材を分析中...'):
                 try:
-                    genai.configure(api_key=api_key)
-                    model = genai.GenerativeModel('gemini-1.5-flash')
-                    prompt = """
-                    メニュー写真から使われている主な材料を推測してください。
-                    必ず以下のJSON形式のみで回答してください。
-                    {"materials": [{"name": "材料名", "market_price": 500, "qty": 1, "unit": "kg"}]}
-                    """
-                    response = model.generate_content([prompt, img])
-                    json_str = re.search(r'\[.*\]|\{.*\}', response.text, re.DOTALL).group()
-                    analysis_res = json.loads(json_str)
-                    
-                    master_df = load_products()
-                    proposal_list = []
+                    image_hashes = tuple(hashlib.sha256(image_bytes).hexdigest() for image_bytes in images)
+                    # 商品マスタの読み込みを別スレッドで進め、Geminiの応答待ちと重ねる
+                    with ThreadPoolExecutor(max_workers=1, initializer=add_script_run_ctx,
+                                            initargs=(None, get_script_run_ctx())) as executor:
+                        master_future = executor.submit(get_product_master, PRODUCTS_CSV, file_mtime(PRODUCTS_CSV))
+                        analysis_res = analyze_menu(api_key, image_hashes, images, MENU_PROMPT)
+                        master = master_future.result()
                     
-                    for item in analysis_res.get("materials", []):
-                        match, score = find_best_match(item["name"], master_df, match_level)
-                        proposal_list.append({
-                            "考えられる使用材料名\n(Estimated Ingredient)": item["name"],
-                            "推定市場単価\n(Market Price)": item["market_price"],
-                            "自社商品No.\n(Product No)": match["アクト商品CD"] if match is not None else "---",
-                            "自社商品名\n(Our Product Name)": match["商品名"] if match is not None else "該当なし/要確認",
-                            "自社単価\n(Our Price)": match["アクト単価"] if match is not None else 0,
-                            "数量\n(Qty)": item["qty"],
-                            "単位\n(Unit)": match["［単位］"] if match is not None else item["unit"]
-                        })
-
-                    if proposal_list:
-                        st.session_state.result_df = pd.DataFrame(proposal_list)
+                    materials = analysis_res.get("materials", [])
+                    if materials:
+                        matches = find_best_matches([item["name"] for item in materials], master, match_level)
+                        st.session_state.result_df = build_proposal_table(materials, matches)
                     else:
                         st.error("食材が抽出できませんでした。")
                 except Exception as e:
                     st.error(f"解析エラー: {e}")
+else:
+    # 写真がすべて外されたら保持していた縮小画像も破棄する
+    st.session_state.pop("shrunk_images", None)
 
 # 3. 比較表
-if 'result_df' in st.session_state:
+# 表の編集ではこの部分だけを再実行する（画面全体の再実行を避ける）
+@st.fragment
+def show_proposal(cust_name, cust_contact, staff_name):
     st.markdown("### 📊 3. コスト比較提案表")
-    edited_df = st.data_editor(st.session_state.result_df, use_container_width=True, num_rows="dynamic")
+    edited_df = st.data_editor(
+        st.session_state.result_df, column_config=PROPOSAL_COLUMN_CONFIG,
+        use_container_width=True, num_rows="dynamic",
+    )
     
-    m_sum = (edited_df["推定市場単価\n(Market Price)"].astype(float) * edited_df["数量\n(Qty)"].astype(float)).sum()
-    o_sum = (edited_df["自社単価\n(Our Price)"].astype(float) * edited_df["数量\n(Qty)"].astype(float)).sum()
-    diff = m_sum - o_sum
+    m_sum, o_sum, diff = calc_totals(edited_df)
     
     col1, col2, col3 = st.columns(3)
     col1.metric("推定市場コスト総額", f"¥{m_sum:,.0f}")
@@ -176,13 +113,15 @@ if 'result_df' in st.session_state:
 
     st.divider()
     
-    # CSV保存処理（未入力でも動作するように調整）
-    csv_body = edited_df.to_csv(index=False)
+    # CSV保存処理（未入力でも動作するように調整。再実行は表の編集時のみなので都度作成する）
     header = f"お客様名,{cust_name}\n連絡先,{cust_contact}\n自社担当者,{staff_name}\n\n"
-    full_csv = (header + csv_body).encode('utf-8-sig')
+    full_csv = build_proposal_csv(header, edited_df)
     
     filename = f"提案書_{cust_name}.csv" if cust_name else "提案書.csv"
     
     st.download_button("📥 提案資料(CSV)を保存する", data=full_csv, file_name=filename, mime="text/csv", use_container_width=True)
 
+if 'result_df' in st.session_state:
+    show_proposal(cust_name, cust_contact, staff_name)
+
 st.markdown("---")
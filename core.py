@@ -0,0 +1,283 @@
+import streamlit as st
+import pandas as pd
+import google.generativeai as genai
+import orjson
+import os
+import io
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+from collections import namedtuple
+from PIL import Image, ImageOps
+from rapidfuzz import process, fuzz, utils
+
+# ----------------------------
+# 共通ロジック（画面デザイン・APIキー・商品マスタ・照合・Gemini解析）
+# ----------------------------
+
+STYLE_CSS = "style.css"
+
+@st.cache_data
+def load_css(file_path):
+    """画面デザイン（ネイビー＆オレンジ）のCSSを読み込み"""
+    with open(file_path, encoding="utf-8") as f:
+        return f.read()
+
+# Streamlitは再実行で出力し直さなかった要素を消すため、毎回適用する（ファイル読み込みはキャッシュ済み）
+def apply_style():
+    """共通のCSSを画面に適用"""
+    st.markdown(f"<style>{load_css(STYLE_CSS)}</style>", unsafe_allow_html=True)
+
+def get_api_key():
+    """SecretsからAPIキーを取得"""
+    for key_name in ["GEMINI_API_KEY", "GOOGLE_API_KEY"]:
+        if key_name in st.secrets:
+            return st.secrets[key_name]
+    return None
+
+# 解析プロンプト（回答形式は MENU_SCHEMA で指定するため、ここでは内容だけを伝える）
+MENU_PROMPT = (
+    "メニュー写真から使われている主な材料を推測してください。"
+    "各材料について材料名・推定市場単価（円）・数量・単位を答え、"
+    "写真が複数ある場合はすべての写真の材料を1つの materials リストにまとめてください。"
+)
+
+# Geminiに返させるJSONの構造（構造化出力で解析可能なJSONを保証する）
+MENU_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "materials": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "name": {"type": "STRING"},
+                    "market_price": {"type": "NUMBER"},
+                    "qty": {"type": "NUMBER"},
+                    "unit": {"type": "STRING"},
+                },
+                "required": ["name", "market_price", "qty", "unit"],
+            },
+        },
+    },
+    "required": ["materials"],
+}
+
+ProductMaster = namedtuple("ProductMaster", ["df", "choices", "canon", "exact", "rows"])
+
+# google-generativeai の接続先キーはプロセス全体で1つ（genai.configure の設定を全セッションで共有）。
+# 本アプリはプロセス内で1つのAPIキーを使う前提とし、キャッシュ済みのモデルやアップロードが
+# 別のキーの設定で動かないよう、APIを呼ぶ直前に毎回 configure し直す。
+# 異なるキーを入力したセッションが同時に解析すると設定が入れ替わる可能性は残る。
+@st.cache_resource
+def get_gemini_model(api_key):
+    """Geminiモデルの生成（再実行をまたいで再利用）"""
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel('gemini-1.5-flash')
+
+# Files APIのファイルは48時間で削除されるため、それより短い期間だけ再利用する
+@st.cache_resource(ttl=60 * 60 * 24, show_spinner=False)
+def upload_image(api_key, image_hash, _image_bytes, mime_type):
+    """画像をFiles APIへ一度だけアップロードし、ファイルハンドルを再利用"""
+    genai.configure(api_key=api_key)
+    return genai.upload_file(io.BytesIO(_image_bytes), mime_type=mime_type)
+
+@st.cache_data(show_spinner=False)
+def analyze_menu(api_key, image_hashes, _images, prompt):
+    """メニュー画像の解析（複数枚を1回のリクエストで送信、同じ画像・プロンプトはキャッシュから返す）"""
+    model = get_gemini_model(api_key)
+    image_files = [
+        upload_image(api_key, image_hash, image_bytes, "image/jpeg")
+        for image_hash, image_bytes in zip(image_hashes, _images)
+    ]
+    # モデルは最初の generate_content で既定クライアントに結び付くため、直前にこのキーで設定する
+    genai.configure(api_key=api_key)
+    response = model.generate_content(
+        [prompt] + image_files,
+        generation_config={"response_mime_type": "application/json", "response_schema": MENU_SCHEMA},
+    )
+    # キャッシュ関数内で解析し、壊れた応答は例外にしてキャッシュに残さない
+    try:
+        return orjson.loads(response.text)
+    except orjson.JSONDecodeError as e:
+        raise ValueError(f"AIの応答をJSONとして解析できませんでした: {e}") from e
+
+def shrink_image(img, max_size=1024, quality=85):
+    """送信用に長辺を縮小し、JPEGに再圧縮したバイト列を返す（開いたばかりの画像を渡すこと）"""
+    # JPEGはデコード時点で縮小（DCTスケーリング）し、フル解像度の展開を避ける
+    img.draft("RGB", (max_size, max_size))
+    # 再圧縮でEXIFの回転情報が失われるため、先に向きを反映しておく
+    small = ImageOps.exif_transpose(img).convert("RGB")
+    small.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+    buf = io.BytesIO()
+    small.save(buf, format="JPEG", quality=quality, optimize=True)
+    return buf.getvalue()
+
+def canonicalize(name):
+    """正規化したトークンを並べ替えた文字列（token_sort の前処理を事前に済ませる。欠損値は空文字）"""
+    if name is None or pd.isna(name):
+        return ""
+    return " ".join(sorted(utils.default_process(str(name)).split()))
+
+def build_product_master(df):
+    """照合用の商品名リストと、同じ並びの行データリストを作成（商品名が空欄の行は除く）"""
+    if df.empty or "商品名" not in df.columns:
+        return ProductMaster(df, [], [], {}, [])
+    # 商品名が空欄の行は照合候補から外す（"nan" などの文字列として一致させない）
+    named = df[df["商品名"].notna() & (df["商品名"].astype(str).str.strip() != "")]
+    choices = named["商品名"].astype(str).tolist()
+    canon = [canonicalize(name) for name in choices]
+    # 正規化後の名前が完全一致する商品の位置（同名は先頭を優先。欠損・空の名前は登録しない）
+    exact = {}
+    for idx, (name, source) in enumerate(zip(canon, named["商品名"])):
+        if name and not pd.isna(source):
+            exact.setdefault(name, idx)
+    # 同名の商品は同じスコアになり argmax が先頭を選ぶため、位置で引けば従来どおり最初の行になる
+    rows = named.to_dict("records")
+    return ProductMaster(df, choices, canon, exact, rows)
+
+# 列の型を明示して型推論を省く（商品CDは先頭ゼロを保持。画面で使わない数量は「-」などが入っても読めるよう文字列）
+PRODUCT_DTYPES = {"アクト商品CD": str, "商品名": str, "［数量］": str, "［単位］": str}
+
+def read_products_csv(file_path):
+    """商品CSVの読み込みと単価の数値化"""
+    # pyarrow のマルチスレッドCSVリーダーで読み込む
+    try:
+        df = pd.read_csv(file_path, engine="pyarrow", encoding="utf-8-sig", dtype=PRODUCT_DTYPES)
+    except UnicodeDecodeError:
+        df = pd.read_csv(file_path, engine="pyarrow", encoding="shift-jis", dtype=PRODUCT_DTYPES)
+    if "アクト単価" in df.columns:
+        df["アクト単価"] = pd.to_numeric(df["アクト単価"], errors='coerce').fillna(0)
+    return df
+
+PRODUCTS_CSV = "products.csv"
+
+def file_mtime(file_path):
+    """キャッシュキー用のファイル更新時刻（ファイルがなければ None）"""
+    return os.path.getmtime(file_path) if os.path.exists(file_path) else None
+
+# Parquetのメタデータに元CSVの更新時刻を記録し、完全に一致するときだけキャッシュを使う
+# （cp -p や rsync -a などで古い更新時刻のCSVに差し替えられても取り違えない）
+PARQUET_SOURCE_MTIME = b"source_mtime"
+
+def read_products_cache(cache_path, mtime):
+    """元CSVと更新時刻が一致するParquetキャッシュを読み込み（使えなければ None）"""
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        metadata = pq.read_schema(cache_path).metadata or {}
+    except Exception:
+        return None  # 壊れたキャッシュはCSVから作り直す
+    if metadata.get(PARQUET_SOURCE_MTIME) != repr(mtime).encode():
+        return None
+    return pd.read_parquet(cache_path)
+
+def write_products_cache(df, cache_path, mtime):
+    """元CSVの更新時刻を記録してParquetキャッシュを書き出し"""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    metadata = {**(table.schema.metadata or {}), PARQUET_SOURCE_MTIME: repr(mtime).encode()}
+    pq.write_table(table.replace_schema_metadata(metadata), cache_path, compression="zstd")
+
+# 更新時刻をキーに含め、products.csv を差し替えたら再起動なしで読み直す
+@st.cache_data(max_entries=1)
+def load_products(file_path, mtime):
+    """アクト商品データの読み込み（変換済みのParquetがあればそちらを使用）"""
+    cache_path = os.path.splitext(file_path)[0] + ".parquet"
+    try:
+        if mtime is None:
+            st.error(f"⚠️ ファイル '{file_path}' が見つかりません。")
+            return pd.DataFrame()
+        df = read_products_cache(cache_path, mtime)
+        if df is not None:
+            return df
+        df = read_products_csv(file_path)
+        try:
+            write_products_cache(df, cache_path, mtime)
+        except Exception:
+            pass  # キャッシュが書けなくてもCSVの内容で続行
+        return df
+    except Exception as e:
+        st.error(f"データ読み込みエラー: {e}")
+        return pd.DataFrame()
+
+# st.cache_data はヒットのたびに戻り値を複製するため、照合用の索引は
+# st.cache_resource で同じオブジェクトをそのまま返す（読み取り専用で扱うこと）
+@st.cache_resource(max_entries=1)
+def get_product_master(file_path, mtime):
+    """照合用の商品マスタ（商品名リスト・正規化済み名・行データ）を取得"""
+    return build_product_master(load_products(file_path, mtime))
+
+def find_best_matches(ingredient_names, master, threshold):
+    """商品名との曖昧マッチング（完全一致は辞書で即決し、残りをまとめて一括スコアリング）"""
+    if not master.choices or not ingredient_names:
+        return [(None, 0)] * len(ingredient_names)
+    queries = [canonicalize(name) for name in ingredient_names]
+    results = [None] * len(queries)
+    fuzzy_pos = []
+    for pos, query in enumerate(queries):
+        idx = master.exact.get(query)
+        if idx is not None:
+            results[pos] = (master.rows[idx], 100)
+        else:
+            fuzzy_pos.append(pos)
+    if not fuzzy_pos:
+        return results
+    scores = process.cdist(
+        [queries[pos] for pos in fuzzy_pos], master.canon,
+        scorer=fuzz.partial_ratio, processor=None,
+        workers=-1, dtype=np.uint8,
+    )
+    # argmax の位置からスコアを取り出し、行列の再走査（max）を省く
+    best_idx = scores.argmax(axis=1)
+    best_scores = np.take_along_axis(scores, best_idx[:, None], axis=1)[:, 0]
+    matched = best_scores >= threshold
+    for pos, idx, score, ok in zip(fuzzy_pos, best_idx.tolist(), best_scores.tolist(), matched.tolist()):
+        results[pos] = (master.rows[idx], int(score)) if ok else (None, 0)
+    return results
+
+# 比較提案表の列定義（型を固定し、data_editor の型推論を省く。
+# 単価は小数を含むことがあるため表示形式は既定のままにし、合計・CSVと同じ値を見せる）
+PROPOSAL_COLUMN_CONFIG = {
+    "考えられる使用材料名\n(Estimated Ingredient)": st.column_config.TextColumn(),
+    "推定市場単価\n(Market Price)": st.column_config.NumberColumn(min_value=0),
+    "自社商品No.\n(Product No)": st.column_config.TextColumn(),
+    "自社商品名\n(Our Product Name)": st.column_config.TextColumn(),
+    "自社単価\n(Our Price)": st.column_config.NumberColumn(min_value=0),
+    "数量\n(Qty)": st.column_config.NumberColumn(min_value=0),
+    "単位\n(Unit)": st.column_config.TextColumn(),
+}
+
+def build_proposal_table(materials, matches):
+    """解析結果と照合結果から比較提案表を作成（列ごとに配列を組み立て、数値列は float64・未照合の単価は空欄）"""
+    rows = [match for match, _ in matches]
+    return pd.DataFrame({
+        "考えられる使用材料名\n(Estimated Ingredient)": [item["name"] for item in materials],
+        "推定市場単価\n(Market Price)": np.array([item["market_price"] for item in materials], dtype=np.float64),
+        "自社商品No.\n(Product No)": [row["アクト商品CD"] if row is not None else "---" for row in rows],
+        "自社商品名\n(Our Product Name)": [row["商品名"] if row is not None else "該当なし/要確認" for row in rows],
+        "自社単価\n(Our Price)": np.array([row["アクト単価"] if row is not None else np.nan for row in rows], dtype=np.float64),
+        "数量\n(Qty)": np.array([item["qty"] for item in materials], dtype=np.float64),
+        "単位\n(Unit)": [row["［単位］"] if row is not None else item["unit"] for row, item in zip(rows, materials)],
+    })
+
+def calc_totals(df):
+    """市場コスト・自社コストの総額と削減額を計算（価格2列 × 数量を1回の行列積で集計）"""
+    prices = df[["推定市場単価\n(Market Price)", "自社単価\n(Our Price)"]].to_numpy(dtype=np.float64, na_value=0.0)
+    qty = df["数量\n(Qty)"].to_numpy(dtype=np.float64, na_value=0.0)
+    m_sum, o_sum = (qty @ prices).tolist()
+    return m_sum, o_sum, m_sum - o_sum
+
+# キャッシュしない：DataFrameのハッシュ計算と戻り値の複製の方が、pyarrowでの書き出しより重いため
+def build_proposal_csv(header, df):
+    """提案資料CSVのバイト列を作成"""
+    buf = io.BytesIO()
+    buf.write(header.encode('utf-8-sig'))
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    except pa.ArrowException:
+        # 列内で型が混在するなどArrowに変換できない場合はpandasで書き出す
+        df.to_csv(buf, index=False, encoding='utf-8')
+    else:
+        pacsv.write_csv(table, buf)
+    return buf.getvalue()